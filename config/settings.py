@@ -5,10 +5,19 @@ Configuration settings for Network Utilization Agent
 # Utilization threshold
 UTILIZATION_THRESHOLD = 85.0
 
+# Warehouse rows (over + under) in one region from which the reallocation
+# fill is JIT-compiled with numba. The Python loop costs about 2 µs per row
+# and numba's import plus compile about half a second, so they break even here
+GREEDY_FILL_JIT_MIN_ROWS = 250000
+
 # Email configuration
 SMTP_SERVER = "smtp.gmail.com"
 SMTP_PORT = 587
 
+# Messages per Gmail batch request (Google caps batches at 100 and advises
+# staying at or below 50 for Gmail to avoid rate limiting)
+GMAIL_BATCH_SIZE = 50
+
 # Color coding for email
 COLOR_OVERUTILIZED = "#ff4444"  # Red
 COLOR_UNDERUTILIZED = "#44ff44"  # Green
@@ -18,12 +27,28 @@ COLOR_OPTIMAL = "#ffaa00"  # Orange
 AGENT_NAME = "Network Utilization Agent"
 COMPANY_NAME = "Supply Chain AI Solutions"
 
+# Output token budget per region for the batched LLM insight request
+# (three sentences plus the JSON key, with headroom so replies aren't cut off)
+INSIGHT_TOKENS_PER_REGION = 150
+
+# Skip the LLM insight when every over-utilized warehouse is within this many
+# percentage points of the threshold
+INSIGHT_SKIP_TOLERANCE = 5.0
+
+# SQLite file backing the LLM response cache
+LLM_CACHE_PATH = ".langchain_cache.db"
+
+# SQLite file backing the LangGraph checkpointer
+CHECKPOINT_DB_PATH = "agent_state.db"
+
+# zlib level for checkpoint payloads (1 = fastest, 9 = smallest)
+CHECKPOINT_COMPRESSION_LEVEL = 1
+
 # LangGraph state keys
 STATE_KEYS = {
     "warehouse_data": "warehouse_data",
     "overutilized": "overutilized_warehouses",
     "underutilized": "underutilized_warehouses",
-    "regions": "regions",
     "recommendations": "recommendations",
     "emails": "emails_generated"
 }
\ No newline at end of file
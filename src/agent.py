@@ -1,28 +1,65 @@
 """
 LangGraph workflow for Network Utilization Agent
 """
-from typing import TypedDict, List, Dict, Annotated
+from typing import TypedDict, Dict, Tuple, Annotated
+import json
 import operator
-from langgraph.graph import Graph, StateGraph, END
+import os
+import sqlite3
+import zlib
+import pandas as pd
+from langgraph.graph import StateGraph, END
+from langgraph.graph.state import CompiledStateGraph
+from langgraph.checkpoint.sqlite import SqliteSaver
+from langgraph.checkpoint.serde.jsonplus import JsonPlusSerializer
 from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate
+from langchain.globals import set_llm_cache
+from langchain_community.cache import SQLiteCache
 from datetime import datetime
-from src.data_processor import WarehouseDataProcessor
 
-from config.settings import STATE_KEYS, UTILIZATION_THRESHOLD
+from config.settings import (
+    UTILIZATION_THRESHOLD,
+    INSIGHT_TOKENS_PER_REGION, INSIGHT_SKIP_TOLERANCE, LLM_CACHE_PATH,
+    CHECKPOINT_DB_PATH, CHECKPOINT_COMPRESSION_LEVEL
+)
 from src.data_processor import WarehouseDataProcessor
 from src.email_generator import EmailGenerator
 
+# Persist LLM responses so identical prompts on re-runs skip the API call
+set_llm_cache(SQLiteCache(database_path=LLM_CACHE_PATH))
+
+
+class CompressedSerializer(JsonPlusSerializer):
+    """Checkpoint serializer that zlib-compresses every serialized payload"""
+    
+    SUFFIX = "+zlib"
+    
+    def dumps_typed(self, obj) -> Tuple[str, bytes]:
+        """Serialize with the default msgpack/pickle path, then compress"""
+        type_, payload = super().dumps_typed(obj)
+        return type_ + self.SUFFIX, zlib.compress(payload, CHECKPOINT_COMPRESSION_LEVEL)
+    
+    def loads_typed(self, data: Tuple[str, bytes]):
+        """Decompress if needed, then deserialize"""
+        type_, payload = data
+        if type_.endswith(self.SUFFIX):
+            type_ = type_[:-len(self.SUFFIX)]
+            payload = zlib.decompress(payload)
+        return super().loads_typed((type_, payload))
+
 
 # Define the state structure
 class AgentState(TypedDict):
-    warehouse_data: dict
-    overutilized_warehouses: list
-    underutilized_warehouses: list
-    regions: dict
+    warehouse_data: pd.DataFrame
+    overutilized_warehouses: pd.DataFrame
+    underutilized_warehouses: pd.DataFrame
+    region_summaries: dict
     recommendations: Annotated[list, operator.add]
+    recommendations_by_region: dict
     emails_generated: Annotated[list, operator.add]
     emails_sent: Annotated[list, operator.add]
+    llm_insights: dict
     status: str
     error: str
 
@@ -47,10 +84,21 @@ class NetworkUtilizationAgent:
             temperature=0.3
         )
         
+        # Build the insight prompt once; only the output token budget
+        # varies per call, so it is bound onto the shared model at call time
+        self._insight_prompt = ChatPromptTemplate.from_messages([
+            ("system", "You are a supply chain analyst. Reply with a JSON object only."),
+            ("user", """Pallet moves per region:
+{recommendations}
+
+Give a 3-sentence insight per region covering health, impact and priority.
+Return a JSON object mapping each region name to its insight as one plain string.""")
+        ])
+        
         # Build the graph
         self.graph = self._build_graph()
     
-    def _build_graph(self) -> Graph:
+    def _build_graph(self) -> CompiledStateGraph:
         """Build the LangGraph workflow"""
         workflow = StateGraph(AgentState)
         
@@ -64,12 +112,24 @@ class NetworkUtilizationAgent:
         # Define edges
         workflow.set_entry_point("monitor")
         workflow.add_edge("monitor", "detect")
-        workflow.add_edge("detect", "analyze")
+        workflow.add_conditional_edges(
+            "detect",
+            self.route_after_detect,
+            {"analyze": "analyze", END: END}
+        )
         workflow.add_edge("analyze", "generate_email")
         workflow.add_edge("generate_email", "send_email")
         workflow.add_edge("send_email", END)
         
-        return workflow.compile()
+        # Persist state after every node so an interrupted run can resume
+        # without repeating the Excel parse or the paid LLM call.
+        # The connection is released by close()
+        self.checkpointer = SqliteSaver(
+            sqlite3.connect(CHECKPOINT_DB_PATH, check_same_thread=False),
+            serde=CompressedSerializer(pickle_fallback=True)
+        )
+        
+        return workflow.compile(checkpointer=self.checkpointer)
     
     def monitor_node(self, state: AgentState) -> AgentState:
         """Node 1: Monitor warehouse utilization levels"""
@@ -77,7 +137,7 @@ class NetworkUtilizationAgent:
             # Load and process data
             df = self.processor.load_data()
             
-            state["warehouse_data"] = df.to_dict('records')
+            state["warehouse_data"] = df
             state["status"] = "Monitoring complete"
             
             return state
@@ -91,15 +151,11 @@ class NetworkUtilizationAgent:
         try:
             overutilized, underutilized = self.processor.identify_utilization_issues()
             
-            state["overutilized_warehouses"] = overutilized.to_dict('records')
-            state["underutilized_warehouses"] = underutilized.to_dict('records')
+            state["overutilized_warehouses"] = overutilized
+            state["underutilized_warehouses"] = underutilized
             
-            # Group by region
-            regions = self.processor.group_by_region()
-            state["regions"] = {
-                region: df.to_dict('records') 
-                for region, df in regions.items()
-            }
+            # Per-region summaries for the emails
+            state["region_summaries"] = self.processor.get_all_region_summaries()
             
             state["status"] = f"Detection complete: {len(overutilized)} over-utilized, {len(underutilized)} under-utilized"
             
@@ -109,44 +165,84 @@ class NetworkUtilizationAgent:
             state["status"] = "Error in detection"
             return state
     
+    def route_after_detect(self, state: AgentState) -> str:
+        """Skip analysis and emails when no pallets can be reallocated"""
+        # Reallocation needs at least one warehouse on each side of the threshold
+        if state["overutilized_warehouses"].empty or state["underutilized_warehouses"].empty:
+            return END
+        return "analyze"
+    
     def analyze_node(self, state: AgentState) -> AgentState:
         """Node 3: Analyze and generate recommendations using LLM"""
         try:
-            import pandas as pd
-            
-            overutilized_df = pd.DataFrame(state["overutilized_warehouses"])
-            underutilized_df = pd.DataFrame(state["underutilized_warehouses"])
-            
             # Calculate recommendations
             recommendations = self.processor.calculate_reallocation(
-                overutilized_df, 
-                underutilized_df
+                state["overutilized_warehouses"], 
+                state["underutilized_warehouses"]
             )
             
-            # Use LLM to enhance recommendations with insights
-            if recommendations:
-                prompt = ChatPromptTemplate.from_messages([
-                    ("system", """You are an expert supply chain analyst. 
-                    Analyze the warehouse utilization data and provide strategic insights 
-                    about the recommendations."""),
-                    ("user", """Given these warehouse reallocation recommendations:
-                    {recommendations}
-                    
-                    Provide a brief strategic insight (2-3 sentences) about:
-                    1. The overall network health
-                    2. Potential operational impact
-                    3. Priority of implementation""")
-                ])
+            # Group recommendations by region
+            recommendations_by_region = {}
+            for rec in recommendations:
+                recommendations_by_region.setdefault(rec['region'], []).append(rec)
+            
+            # Store recommendations before the LLM call so a bad reply
+            # can only cost the insights, never the emails
+            state["recommendations"] = recommendations
+            state["recommendations_by_region"] = recommendations_by_region
+            state["llm_insights"] = {}
+            
+            # Skip the LLM when the network is already close to balanced,
+            # i.e. every source warehouse is within tolerance of the threshold
+            within_tolerance = bool(recommendations) and max(
+                abs(rec['from_current_util'] - UTILIZATION_THRESHOLD)
+                for rec in recommendations
+            ) < INSIGHT_SKIP_TOLERANCE
+            
+            if within_tolerance:
+                state["llm_insights"] = {
+                    region: "Network is within tolerance; no strategic action required."
+                    for region in recommendations_by_region
+                }
+            # Use LLM to enhance recommendations with per-region insights,
+            # batching every region into a single request. A single move
+            # needs no strategic summary, so its insights stay empty
+            elif len(recommendations) > 1:
+                # One compact line per region keeps input tokens low
+                batched = "\n".join(
+                    f"[{i}] {region}: " + "; ".join(
+                        f"move {r['pallets_to_move']} from {r['from_warehouse']}"
+                        f"({r['from_current_util']:.0f}%) to {r['to_warehouse']}"
+                        f"({r['to_current_util']:.0f}%)"
+                        for r in recs
+                    )
+                    for i, (region, recs) in enumerate(recommendations_by_region.items(), 1)
+                )
                 
-                chain = prompt | self.llm
-                response = chain.invoke({
-                    "recommendations": str(recommendations[:3])  # Limit for token efficiency
-                })
+                chain = self._insight_prompt | self.llm.bind(
+                    max_tokens=INSIGHT_TOKENS_PER_REGION * len(recommendations_by_region),
+                    response_format={"type": "json_object"}
+                )
+                response = chain.invoke({"recommendations": batched})
                 
-                # Add LLM insight to state
-                state["llm_insight"] = response.content
+                # Add LLM insights to state; a truncated or malformed reply
+                # leaves the run without insights rather than failing it
+                if response.response_metadata.get("finish_reason") == "length":
+                    print("❌ LLM insight reply hit the token limit; skipping insights")
+                else:
+                    try:
+                        insights = json.loads(response.content)
+                    except ValueError as e:
+                        print(f"❌ Could not parse LLM insights: {str(e)}")
+                        insights = {}
+                    
+                    if isinstance(insights, dict):
+                        state["llm_insights"] = {
+                            region: insights[region]
+                            for region in recommendations_by_region
+                            if isinstance(insights.get(region), str)
+                        }
             
-            state["recommendations"] = recommendations
             state["status"] = f"Analysis complete: {len(recommendations)} recommendations generated"
             
             return state
@@ -159,19 +255,17 @@ class NetworkUtilizationAgent:
         """Node 4: Generate and prepare emails for branch managers"""
         try:
             emails_generated = []
-            recommendations_by_region = {}
             
-            # Group recommendations by region
-            for rec in state.get("recommendations", []):
-                region = rec['region']
-                if region not in recommendations_by_region:
-                    recommendations_by_region[region] = []
-                recommendations_by_region[region].append(rec)
+            # Recommendations are grouped once in analyze_node
+            recommendations_by_region = state.get("recommendations_by_region", {})
+            
+            # One report time for the whole batch
+            now = datetime.now()
             
             # Generate email for each region
             for region, recs in recommendations_by_region.items():
-                # Get region summary
-                region_summary = self.processor.get_region_summary(region)
+                # Get region summary precomputed in detect_node
+                region_summary = state["region_summaries"][region]
                 
                 # Get manager details from first recommendation
                 manager_name = recs[0]['branch_manager']
@@ -183,7 +277,8 @@ class NetworkUtilizationAgent:
                         region=region,
                         warehouses_df=region_summary,
                         recommendations=recs,
-                        manager_name=manager_name
+                        manager_name=manager_name,
+                        now=now
                     )
                     
                     emails_generated.append({
@@ -211,41 +306,36 @@ class NetworkUtilizationAgent:
                 state["emails_sent"] = []
                 return state
             
-            emails_sent = []
+            emails = state.get("emails_generated", [])
             
-            for email in state.get("emails_generated", []):
-                subject = f"🏭 Warehouse Utilization Report - {email['region']} Region"
+            # Send everything through Gmail batch requests
+            results = self.email_gen.send_emails_batch([
+                (
+                    email['manager_email'],
+                    f"🏭 Warehouse Utilization Report - {email['region']} Region",
+                    email['html_content']
+                )
+                for email in emails
+            ])
+            timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            
+            emails_sent = []
+            for email, (success, error) in zip(emails, results):
+                entry = {
+                    'region': email['region'],
+                    'manager_name': email['manager_name'],
+                    'manager_email': email['manager_email'],
+                    'success': success,
+                    'timestamp': timestamp
+                }
                 
-                try:
-                    success = self.email_gen.send_email(
-                        recipient_email=email['manager_email'],
-                        subject=subject,
-                        html_content=email['html_content']
-                    )
-                    
-                    emails_sent.append({
-                        'region': email['region'],
-                        'manager_name': email['manager_name'],
-                        'manager_email': email['manager_email'],
-                        'success': success,
-                        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    })
-                    
-                    if success:
-                        print(f"✅ Email sent to {email['manager_email']} ({email['region']})")
-                    else:
-                        print(f"❌ Failed to send email to {email['manager_email']} ({email['region']})")
-                        
-                except Exception as e:
-                    print(f"❌ Error sending to {email['manager_email']}: {str(e)}")
-                    emails_sent.append({
-                        'region': email['region'],
-                        'manager_name': email['manager_name'],
-                        'manager_email': email['manager_email'],
-                        'success': False,
-                        'error': str(e),
-                        'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    })
+                if success:
+                    print(f"✅ Email sent to {email['manager_email']} ({email['region']})")
+                else:
+                    print(f"❌ Failed to send email to {email['manager_email']} ({email['region']}): {error}")
+                    entry['error'] = error
+                
+                emails_sent.append(entry)
             
             state["emails_sent"] = emails_sent
             success_count = sum(1 for e in emails_sent if e.get('success', False))
@@ -260,33 +350,72 @@ class NetworkUtilizationAgent:
     def run(self) -> AgentState:
         """Execute the complete workflow"""
         initial_state = {
-            "warehouse_data": {},
-            "overutilized_warehouses": [],
-            "underutilized_warehouses": [],
-            "regions": {},
+            "warehouse_data": pd.DataFrame(),
+            "overutilized_warehouses": pd.DataFrame(),
+            "underutilized_warehouses": pd.DataFrame(),
+            "region_summaries": {},
             "recommendations": [],
+            "recommendations_by_region": {},
             "emails_generated": [],
             "emails_sent": [],
+            "llm_insights": {},
             "status": "Starting",
             "error": ""
         }
         
-        result = self.graph.invoke(initial_state)
+        # One checkpoint thread per version of the workbook
+        try:
+            mtime = os.path.getmtime(self.excel_path)
+        except OSError as e:
+            # Report a missing or unreadable workbook the way monitor_node does
+            initial_state["error"] = f"Monitoring error: {str(e)}"
+            initial_state["status"] = "Error in monitoring"
+            return initial_state
+        
+        thread_prefix = f"{os.path.abspath(self.excel_path)}@"
+        thread_id = f"{thread_prefix}{mtime}"
+        config = {"configurable": {"thread_id": thread_id}}
+        
+        self._prune_checkpoints(thread_prefix, thread_id)
+        
+        if self.graph.get_state(config).next:
+            # A previous run on this workbook stopped part-way; resume it
+            return self.graph.invoke(None, config)
+        
+        # Start fresh, dropping any finished run so list reducers don't append to it
+        self.checkpointer.delete_thread(thread_id)
+        result = self.graph.invoke(initial_state, config)
         return result
     
+    def _prune_checkpoints(self, thread_prefix: str, keep_thread_id: str):
+        """Drop checkpoint threads left by earlier versions of the same workbook"""
+        with self.checkpointer.cursor() as cur:
+            cur.execute(
+                "SELECT DISTINCT thread_id FROM checkpoints WHERE substr(thread_id, 1, ?) = ?",
+                (len(thread_prefix), thread_prefix)
+            )
+            stale = [row[0] for row in cur.fetchall() if row[0] != keep_thread_id]
+        
+        for old_thread_id in stale:
+            self.checkpointer.delete_thread(old_thread_id)
+    
+    def close(self):
+        """Close the checkpoint database connection"""
+        self.checkpointer.conn.close()
+    
     def send_emails(self, state: AgentState) -> Dict[str, bool]:
         """Send all generated emails"""
         if not self.email_gen:
             return {"error": "Email generator not configured"}
         
-        results = {}
-        for email in state.get("emails_generated", []):
-            subject = f"🏭 Warehouse Utilization Report - {email['region']} Region"
-            success = self.email_gen.send_email(
-                recipient_email=email['manager_email'],
-                subject=subject,
-                html_content=email['html_content']
+        emails = state.get("emails_generated", [])
+        results = self.email_gen.send_emails_batch([
+            (
+                email['manager_email'],
+                f"🏭 Warehouse Utilization Report - {email['region']} Region",
+                email['html_content']
             )
-            results[email['region']] = success
+            for email in emails
+        ])
         
-        return results
\ No newline at end of file
+        return {email['region']: success for email, (success, _) in zip(emails, results)}
@@ -3,12 +3,14 @@ Streamlit UI for Network Utilization Agent
 """
 import streamlit as st
 import pandas as pd
+import numpy as np
 from datetime import datetime
+import hashlib
 import os
 from dotenv import load_dotenv
 from src.agent import NetworkUtilizationAgent
+from src.data_processor import read_warehouse_excel
 from config.settings import UTILIZATION_THRESHOLD, COLOR_OVERUTILIZED, COLOR_UNDERUTILIZED
-from src.agent import NetworkUtilizationAgent
 
 # Load environment variables
 load_dotenv()
@@ -21,6 +23,12 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Cached workbook loader
+@st.cache_data(show_spinner=False)
+def load_warehouse_excel(path: str, mtime: float) -> pd.DataFrame:
+    """Read the uploaded workbook once per file version"""
+    return read_warehouse_excel(path)
+
 # Custom CSS
 st.markdown("""
 <style>
@@ -139,13 +147,18 @@ with tab1:
         )
         
         if uploaded_file:
-            # Save uploaded file temporarily
+            # Save uploaded file temporarily, only rewriting it when the
+            # content changes so the cached parse stays valid across reruns
             temp_path = f"temp_{uploaded_file.name}"
-            with open(temp_path, "wb") as f:
-                f.write(uploaded_file.getbuffer())
+            file_hash = hashlib.md5(uploaded_file.getbuffer()).hexdigest()
+            if (st.session_state.get('excel_hash') != file_hash
+                    or not os.path.exists(temp_path)):
+                with open(temp_path, "wb") as f:
+                    f.write(uploaded_file.getbuffer())
+                st.session_state['excel_hash'] = file_hash
             
             # Load and display data
-            df = pd.read_excel(temp_path)
+            df = load_warehouse_excel(temp_path, os.path.getmtime(temp_path))
             
             st.success(f"✅ Loaded {len(df)} warehouses from {uploaded_file.name}")
             
@@ -208,7 +221,10 @@ with tab2:
                             progress_text.text("📧 Step 4/5: Generating emails...")
                             progress_text.text("📤 Step 5/5: Sending emails automatically...")
                             
-                            result = agent.run()
+                            try:
+                                result = agent.run()
+                            finally:
+                                agent.close()
                             st.session_state['analysis_result'] = result
                             st.session_state['agent'] = agent
                             
@@ -299,13 +315,14 @@ with tab2:
                         st.success(f"**Move {rec['pallets_to_move']} pallets** to optimize utilization")
             
             # LLM Insights
-            if result.get('llm_insight'):
+            if result.get('llm_insights'):
                 st.subheader("🤖 AI Strategic Insights")
-                st.markdown(f"""
-                <div class="metric-card">
-                    {result['llm_insight']}
-                </div>
-                """, unsafe_allow_html=True)
+                for region, insight in result['llm_insights'].items():
+                    st.markdown(f"""
+                    <div class="metric-card">
+                        <strong>{region}:</strong> {insight}
+                    </div>
+                    """, unsafe_allow_html=True)
     else:
         st.info("👆 Please upload warehouse data in the Upload Data tab first")
 
@@ -376,11 +393,8 @@ with tab4:
     st.header("📊 Dashboard")
     
     if st.session_state.get('data_loaded'):
-        df = pd.read_excel(st.session_state['excel_path'])
-        
-        # Calculate utilization if not present
-        if 'Utilization_Percentage' not in df.columns:
-            df['Utilization_Percentage'] = (df['Current_Pallets'] / df['Total_Capacity_Pallets'] * 100).round(2)
+        excel_path = st.session_state['excel_path']
+        df = load_warehouse_excel(excel_path, os.path.getmtime(excel_path))
         
         # Overall metrics
         col1, col2, col3, col4 = st.columns(4)
@@ -415,15 +429,17 @@ with tab4:
         # Warehouse status table
         st.subheader("🏭 Warehouse Status")
         
-        def highlight_utilization(val):
-            if val > threshold:
-                return f'background-color: {COLOR_OVERUTILIZED}; color: white'
-            else:
-                return f'background-color: {COLOR_UNDERUTILIZED}; color: black'
+        def highlight_utilization(col):
+            # One vectorized comparison for the whole column
+            return np.where(
+                col.to_numpy() > threshold,
+                f'background-color: {COLOR_OVERUTILIZED}; color: white',
+                f'background-color: {COLOR_UNDERUTILIZED}; color: black'
+            )
         
         styled_df = df[['Warehouse_ID', 'Warehouse_Name', 'Region', 
                        'Total_Capacity_Pallets', 'Current_Pallets', 
-                       'Utilization_Percentage']].style.applymap(
+                       'Utilization_Percentage']].style.apply(
             highlight_utilization,
             subset=['Utilization_Percentage']
         )
@@ -1,10 +1,167 @@
 """
 Data processing module for warehouse utilization analysis
 """
+import functools
+import os
+
+import numpy as np
 import pandas as pd
 from typing import Dict, List, Tuple
 
-from config.settings import UTILIZATION_THRESHOLD
+from config.settings import UTILIZATION_THRESHOLD, GREEDY_FILL_JIT_MIN_ROWS
+
+# Columns shown in the per-region summary
+REGION_SUMMARY_COLUMNS = [
+    'Warehouse_ID', 'Warehouse_Name', 'Total_Capacity_Pallets',
+    'Current_Pallets', 'Utilization_Percentage', 'Branch_Manager_Name'
+]
+
+# Columns needed to build a reallocation recommendation
+REALLOCATION_COLUMNS = [
+    'Warehouse_ID', 'Warehouse_Name', 'Total_Capacity_Pallets',
+    'Current_Pallets', 'Utilization_Percentage', 'Branch_Manager_Name',
+    'Branch_Manager_Email'
+]
+
+# Fields of a reallocation recommendation, in output order
+RECOMMENDATION_FIELDS = [
+    'region', 'from_warehouse', 'from_name', 'to_warehouse', 'to_name',
+    'pallets_to_move', 'from_current_util', 'to_current_util',
+    'branch_manager', 'branch_email'
+]
+
+# String columns stored as pandas categoricals after loading
+CATEGORICAL_COLUMNS = [
+    'Region', 'Warehouse_ID', 'Branch_Manager_Name', 'Branch_Manager_Email'
+]
+
+# Pallet counts fit comfortably in 32 bits
+PALLET_DTYPES = {
+    'Current_Pallets': 'int32',
+    'Total_Capacity_Pallets': 'int32'
+}
+
+
+def _greedy_fill(excess: np.ndarray, available: np.ndarray):
+    """
+    Greedy two-pointer fill of excess pallets into available space, in order
+    Each target is consumed until it reaches the threshold, then the next one
+    takes over. Returns (source_idx, target_idx, pallets) arrays, one entry per move
+    """
+    available = available.copy()
+    
+    # Every move exhausts either its source or its target
+    max_moves = len(excess) + len(available)
+    sources = np.empty(max_moves, dtype=np.int64)
+    targets = np.empty(max_moves, dtype=np.int64)
+    pallets = np.empty(max_moves, dtype=np.int64)
+    
+    moves = 0
+    t = 0
+    for i in range(len(excess)):
+        remaining = excess[i]
+        
+        while remaining > 0 and t < len(available):
+            if available[t] <= 0:
+                t += 1
+                continue
+            
+            moved = min(remaining, available[t])
+            sources[moves] = i
+            targets[moves] = t
+            pallets[moves] = moved
+            moves += 1
+            
+            remaining -= moved
+            available[t] -= moved
+    
+    return sources[:moves], targets[:moves], pallets[:moves]
+
+
+@functools.lru_cache(maxsize=None)
+def _jit_greedy_fill():
+    """
+    Numba-compiled _greedy_fill, or None when numba is not installed
+    Imported and compiled on first use since numba is slow to load
+    """
+    try:
+        from numba import njit
+    except ImportError:  # optional JIT for very large regions
+        return None
+    return njit(cache=True)(_greedy_fill)
+
+
+def read_warehouse_excel(path: str) -> pd.DataFrame:
+    """
+    Read a warehouse workbook, preferring Polars and then pandas' Rust-based
+    calamine engine, and calculate utilization percentage if not present
+    """
+    df = None
+    try:
+        # Imported here so importing this module doesn't pay for polars.
+        # Polars parses straight into Arrow columns; convert at the boundary
+        import polars as pl
+        df = pl.read_excel(path).to_pandas()
+    except ImportError:
+        # polars not installed, or installed without its fastexcel/pyarrow extras
+        pass
+    
+    if df is None:
+        try:
+            df = pd.read_excel(path, engine="calamine")
+        except ImportError:
+            # python-calamine not installed, fall back to pandas' default engine
+            df = pd.read_excel(path)
+    
+    if 'Utilization_Percentage' not in df.columns:
+        # Plain array arithmetic skips pandas' index alignment
+        current = df['Current_Pallets'].to_numpy()
+        capacity = df['Total_Capacity_Pallets'].to_numpy()
+        df['Utilization_Percentage'] = np.round(current / capacity * 100.0, 2)
+    
+    return df
+
+
+def _region_reallocation(region: str, over_cols: Dict[str, np.ndarray],
+                         under_cols: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Reallocation recommendations for a single region, one array per field"""
+    # Excess pallets above target / available space below target
+    over_excess = over_cols['Current_Pallets'] - (
+        over_cols['Total_Capacity_Pallets'] * (UTILIZATION_THRESHOLD / 100)
+    ).astype(int)
+    under_available = (
+        under_cols['Total_Capacity_Pallets'] * (UTILIZATION_THRESHOLD / 100)
+    ).astype(int) - under_cols['Current_Pallets']
+    
+    # The greedy fill is a plain loop; only regions large enough to repay
+    # numba's import and compile time get the JIT-compiled version
+    fill = _greedy_fill
+    if len(over_excess) + len(under_available) >= GREEDY_FILL_JIT_MIN_ROWS:
+        fill = _jit_greedy_fill() or _greedy_fill
+    
+    sources, targets, pallets = fill(
+        over_excess.astype(np.int64), under_available.astype(np.int64)
+    )
+    
+    # Gather each output column with one fancy-index per region
+    return {
+        'region': np.full(len(pallets), region, dtype=object),
+        'from_warehouse': over_cols['Warehouse_ID'][sources],
+        'from_name': over_cols['Warehouse_Name'][sources],
+        'to_warehouse': under_cols['Warehouse_ID'][targets],
+        'to_name': under_cols['Warehouse_Name'][targets],
+        'pallets_to_move': pallets,
+        'from_current_util': over_cols['Utilization_Percentage'][sources],
+        'to_current_util': under_cols['Utilization_Percentage'][targets],
+        'branch_manager': over_cols['Branch_Manager_Name'][sources],
+        'branch_email': over_cols['Branch_Manager_Email'][sources]
+    }
+
+
+@functools.lru_cache(maxsize=4)
+def _cached_read_excel(path: str, mtime: float) -> pd.DataFrame:
+    """Parse a workbook once per (path, mtime) across processor instances"""
+    return read_warehouse_excel(path)
 
 
 class WarehouseDataProcessor:
@@ -13,16 +170,27 @@ class WarehouseDataProcessor:
     def __init__(self, excel_path: str):
         self.excel_path = excel_path
         self.df = None
+        # Memoized (overutilized, underutilized) split of self.df
+        self._utilization_issues = None
         
     def load_data(self) -> pd.DataFrame:
         """Load warehouse data from Excel file"""
         try:
-            self.df = pd.read_excel(self.excel_path)
-            # Calculate utilization percentage if not present
-            if 'Utilization_Percentage' not in self.df.columns:
-                self.df['Utilization_Percentage'] = (
-                    self.df['Current_Pallets'] / self.df['Total_Capacity_Pallets'] * 100
-                ).round(2)
+            # The mtime in the key invalidates the cache when the file changes
+            df = _cached_read_excel(self.excel_path, os.path.getmtime(self.excel_path))
+            self._utilization_issues = None
+            # Dictionary-encode repeated strings so filters and groupbys
+            # compare integer codes instead of Python strings, and halve
+            # the width of the pallet columns. Blank pallet cells can't be
+            # cast to int, so those columns keep their float dtype and the
+            # rows drop out of both utilization masks via NaN.
+            # astype returns a new frame, so the cached parse is never
+            # modified in place
+            self.df = df.astype({
+                **{col: 'category' for col in CATEGORICAL_COLUMNS},
+                **{col: dtype for col, dtype in PALLET_DTYPES.items()
+                   if df[col].notna().all()}
+            })
             return self.df
         except Exception as e:
             raise Exception(f"Error loading data: {str(e)}")
@@ -34,27 +202,26 @@ class WarehouseDataProcessor:
         """
         if self.df is None:
             self.load_data()
-            
-        overutilized = self.df[
-            self.df['Utilization_Percentage'] > UTILIZATION_THRESHOLD
-        ].copy()
         
-        underutilized = self.df[
-            self.df['Utilization_Percentage'] < UTILIZATION_THRESHOLD
-        ].copy()
+        if self._utilization_issues is not None:
+            return self._utilization_issues
+        
+        # Read the column once and derive both masks from the same array
+        util = self.df['Utilization_Percentage'].to_numpy()
         
-        return overutilized, underutilized
+        overutilized = self.df.iloc[util > UTILIZATION_THRESHOLD]
+        underutilized = self.df.iloc[util < UTILIZATION_THRESHOLD]
+        
+        self._utilization_issues = (overutilized, underutilized)
+        return self._utilization_issues
     
     def group_by_region(self) -> Dict[str, pd.DataFrame]:
         """Group warehouses by region"""
         if self.df is None:
             self.load_data()
         
-        regions = {}
-        for region in self.df['Region'].unique():
-            regions[region] = self.df[self.df['Region'] == region].copy()
-        
-        return regions
+        # Single groupby pass instead of one boolean mask per region
+        return dict(list(self.df.groupby('Region', sort=False, observed=True)))
     
     def calculate_reallocation(self, overutilized: pd.DataFrame, 
                               underutilized: pd.DataFrame) -> List[Dict]:
@@ -62,74 +229,56 @@ class WarehouseDataProcessor:
         Calculate pallet reallocation recommendations
         Returns list of recommendations with source, target, and pallet count
         """
-        recommendations = []
+        return self.calculate_reallocation_frame(
+            overutilized, underutilized
+        ).to_dict('records')
+    
+    def calculate_reallocation_frame(self, overutilized: pd.DataFrame, 
+                                     underutilized: pd.DataFrame) -> pd.DataFrame:
+        """
+        Calculate pallet reallocation recommendations as a DataFrame
+        Built column by column, one row per recommended movement
+        """
+        # Partition both sides by region once instead of masking per region
+        under_by_region = dict(list(
+            underutilized.groupby('Region', sort=False, observed=True)
+        ))
         
-        for region in overutilized['Region'].unique():
-            # Get overutilized warehouses in this region
-            over_in_region = overutilized[
-                overutilized['Region'] == region
-            ].copy()
-            
+        # Regions never exchange pallets, so each one is solved on its own.
+        # Pull the columns out once as NumPy arrays per region
+        results = []
+        for region, over_in_region in overutilized.groupby('Region', sort=False, observed=True):
             # Get underutilized warehouses in this region
-            under_in_region = underutilized[
-                underutilized['Region'] == region
-            ].copy()
+            under_in_region = under_by_region.get(region)
             
-            if under_in_region.empty:
+            if under_in_region is None:
                 continue
             
-            for _, over_wh in over_in_region.iterrows():
-                # Calculate excess pallets
-                target_pallets = int(
-                    over_wh['Total_Capacity_Pallets'] * (UTILIZATION_THRESHOLD / 100)
-                )
-                excess_pallets = over_wh['Current_Pallets'] - target_pallets
-                
-                if excess_pallets <= 0:
-                    continue
-                
-                # Distribute excess to underutilized warehouses
-                remaining_excess = excess_pallets
-                
-                for _, under_wh in under_in_region.iterrows():
-                    if remaining_excess <= 0:
-                        break
-                    
-                    # Calculate available capacity
-                    target_capacity = int(
-                        under_wh['Total_Capacity_Pallets'] * (UTILIZATION_THRESHOLD / 100)
-                    )
-                    available_space = target_capacity - under_wh['Current_Pallets']
-                    
-                    if available_space <= 0:
-                        continue
-                    
-                    # Calculate pallets to move
-                    pallets_to_move = min(remaining_excess, available_space)
-                    
-                    recommendations.append({
-                        'region': region,
-                        'from_warehouse': over_wh['Warehouse_ID'],
-                        'from_name': over_wh['Warehouse_Name'],
-                        'to_warehouse': under_wh['Warehouse_ID'],
-                        'to_name': under_wh['Warehouse_Name'],
-                        'pallets_to_move': int(pallets_to_move),
-                        'from_current_util': over_wh['Utilization_Percentage'],
-                        'to_current_util': under_wh['Utilization_Percentage'],
-                        'branch_manager': over_wh['Branch_Manager_Name'],
-                        'branch_email': over_wh['Branch_Manager_Email']
-                    })
-                    
-                    remaining_excess -= pallets_to_move
+            results.append(_region_reallocation(
+                region,
+                {col: over_in_region[col].to_numpy() for col in REALLOCATION_COLUMNS},
+                {col: under_in_region[col].to_numpy() for col in REALLOCATION_COLUMNS}
+            ))
         
-        return recommendations
+        return pd.DataFrame({
+            field: np.concatenate([result[field] for result in results]) if results else []
+            for field in RECOMMENDATION_FIELDS
+        })
     
     def get_region_summary(self, region: str) -> pd.DataFrame:
         """Get summary of all warehouses in a region"""
         if self.df is None:
             self.load_data()
         
-        return self.df[self.df['Region'] == region][[
-            'Warehouse_ID', 'Warehouse_Name', 'Total_Capacity_Pallets',
-            'Current_Pallets', 'Utilization_Percentage', 'Branch_Manager_Name'
-        ]].copy()
\ No newline at end of file
+        # Mask and projection in a single indexing step
+        return self.df.loc[self.df['Region'] == region, REGION_SUMMARY_COLUMNS]
+    
+    def get_all_region_summaries(self) -> Dict[str, pd.DataFrame]:
+        """Get summaries for every region from a single groupby pass"""
+        if self.df is None:
+            self.load_data()
+        
+        return {
+            region: group[REGION_SUMMARY_COLUMNS]
+            for region, group in self.df.groupby('Region', sort=False, observed=True)
+        }
\ No newline at end of file
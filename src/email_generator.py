@@ -3,26 +3,146 @@ Email generation and sending module with Gmail API (OAuth2)
 """
 import os
 import base64
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from typing import List, Dict
+from string import Template
+from email.header import Header
+from email.headerregistry import Address
+from email.utils import formataddr, getaddresses
+from typing import List, Dict, Tuple
+import numpy as np
 import pandas as pd
 from datetime import datetime
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
 import sys
 sys.path.append('..')
 from config.settings import (
     UTILIZATION_THRESHOLD, COLOR_OVERUTILIZED, 
-    COLOR_UNDERUTILIZED, AGENT_NAME, COMPANY_NAME
+    COLOR_UNDERUTILIZED, AGENT_NAME, COMPANY_NAME, GMAIL_BATCH_SIZE
 )
 
 # Gmail API scopes
 SCOPES = ['https://www.googleapis.com/auth/gmail.send']
 
+# Email skeleton, compiled once at import. The company, agent and threshold
+# values never change, so they are substituted up front and only the
+# per-report fields are left as $-placeholders.
+_EMAIL_TEMPLATE = Template(Template("""
+        <!DOCTYPE html>
+        <html>
+        <head>
+            <meta charset="UTF-8">
+            <meta name="viewport" content="width=device-width, initial-scale=1.0">
+        </head>
+        <body style="font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; line-height: 1.6; color: #333; margin: 0; padding: 0; background-color: #f4f4f4;">
+            <div style="max-width: 800px; margin: 20px auto; background-color: white; border-radius: 10px; overflow: hidden; box-shadow: 0 0 20px rgba(0,0,0,0.1);">
+                
+                <!-- Header -->
+                <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; text-align: center;">
+                    <h1 style="margin: 0; font-size: 28px;">🏭 Network Utilization Report</h1>
+                    <p style="margin: 10px 0 0 0; font-size: 16px; opacity: 0.9;">$company_name</p>
+                </div>
+                
+                <!-- Content -->
+                <div style="padding: 30px;">
+                    <p style="font-size: 16px;">Dear $manager_name,</p>
+                    
+                    <p style="font-size: 15px; line-height: 1.8;">
+                        Our $agent_name has completed its analysis of warehouse utilization across 
+                        <strong>$region</strong> region as of <strong>$report_time</strong>.
+                    </p>
+                    
+                    <div style="background-color: #e7f3ff; border-left: 4px solid #2196F3; padding: 15px; margin: 20px 0; border-radius: 5px;">
+                        <p style="margin: 0; color: #0c5c9c;">
+                            <strong>📊 Target Utilization:</strong> Below $threshold% for optimal operations
+                        </p>
+                    </div>
+                    
+                    <h2 style="color: #667eea; border-bottom: 2px solid #667eea; padding-bottom: 10px;">
+                        Warehouse Status Overview - $region
+                    </h2>
+                    
+                    <table style="width: 100%; border-collapse: collapse; margin: 20px 0; box-shadow: 0 2px 4px rgba(0,0,0,0.1);">
+                        <thead>
+                            <tr style="background-color: #667eea; color: white;">
+                                <th style="padding: 12px; text-align: left; border: 1px solid #ddd;">ID</th>
+                                <th style="padding: 12px; text-align: left; border: 1px solid #ddd;">Warehouse</th>
+                                <th style="padding: 12px; text-align: center; border: 1px solid #ddd;">Capacity</th>
+                                <th style="padding: 12px; text-align: center; border: 1px solid #ddd;">Current</th>
+                                <th style="padding: 12px; text-align: center; border: 1px solid #ddd;">Utilization</th>
+                                <th style="padding: 12px; text-align: center; border: 1px solid #ddd;">Status</th>
+                            </tr>
+                        </thead>
+                        <tbody style="background-color: white;">
+                            $warehouse_rows
+                        </tbody>
+                    </table>
+                    
+                    $recommendations_html
+                    
+                    <div style="background-color: #f8f9fa; padding: 20px; margin: 20px 0; border-radius: 5px; border: 1px solid #dee2e6;">
+                        <h3 style="color: #495057; margin-top: 0;">📌 Next Steps</h3>
+                        <ol style="color: #495057; line-height: 2;">
+                            <li>Review the recommendations above</li>
+                            <li>Coordinate with logistics teams for pallet movements</li>
+                            <li>Implement changes within the next 48-72 hours</li>
+                            <li>Monitor utilization levels post-implementation</li>
+                        </ol>
+                    </div>
+                    
+                    <p style="font-size: 15px;">
+                        If you have any questions or need assistance with implementation, please don't hesitate to reach out.
+                    </p>
+                    
+                    <p style="font-size: 15px;">
+                        Best regards,<br>
+                        <strong>$agent_name</strong><br>
+                        <em>$company_name</em>
+                    </p>
+                </div>
+                
+                <!-- Footer -->
+                <div style="background-color: #f8f9fa; padding: 20px; text-align: center; border-top: 1px solid #dee2e6;">
+                    <p style="margin: 0; font-size: 12px; color: #6c757d;">
+                        This is an automated report generated by AI. For support, contact your system administrator.
+                    </p>
+                    <p style="margin: 5px 0 0 0; font-size: 12px; color: #6c757d;">
+                        © $year $company_name. All rights reserved.
+                    </p>
+                </div>
+                
+            </div>
+        </body>
+        </html>
+        """).safe_substitute(
+    company_name=COMPANY_NAME,
+    agent_name=AGENT_NAME,
+    threshold=UTILIZATION_THRESHOLD
+))
+
+
+def _format_address(address: str) -> str:
+    """
+    Validate a single address for a hand-built header and format it
+    Raises ValueError for line breaks, multiple or malformed addresses and
+    non-ASCII addr-specs; display names are RFC 2047-encoded
+    """
+    # Excel often leaves non-breaking spaces around cell values
+    address = address.strip()
+    if '\r' in address or '\n' in address:
+        raise ValueError(f"Invalid email address {address!r}: contains a line break")
+    
+    parsed = getaddresses([address])
+    if len(parsed) != 1 or not parsed[0][1]:
+        raise ValueError(f"Invalid email address {address!r}")
+    
+    name, addr_spec = parsed[0]
+    if not addr_spec.isascii():
+        raise ValueError(f"Invalid email address {address!r}: contains non-ASCII characters")
+    try:
+        Address(addr_spec=addr_spec)
+    except Exception as e:
+        raise ValueError(f"Invalid email address {address!r}: {str(e)}")
+    
+    return formataddr((name, addr_spec))
+
 
 class EmailGenerator:
     """Generates and sends beautiful HTML emails using Gmail API"""
@@ -35,6 +155,14 @@ class EmailGenerator:
     
     def _authenticate(self):
         """Authenticate with Gmail API using OAuth2"""
+        # Google client libraries are slow to import, so only pay for them
+        # when an EmailGenerator is actually created
+        from google.auth.transport.requests import Request
+        from google.oauth2.credentials import Credentials
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        from googleapiclient.discovery import build
+        from googleapiclient.errors import HttpError
+        
         creds = None
         
         # Token file stores user's access and refresh tokens
@@ -70,26 +198,29 @@ class EmailGenerator:
     
     def generate_html_email(self, region: str, warehouses_df: pd.DataFrame, 
                            recommendations: List[Dict], 
-                           manager_name: str) -> str:
-        """Generate beautiful HTML email with warehouse analysis"""
+                           manager_name: str, now: datetime = None) -> str:
+        """
+        Generate beautiful HTML email with warehouse analysis
+        Pass `now` to stamp a whole batch of emails with the same report time
+        """
+        if now is None:
+            now = datetime.now()
         
         # Build warehouse table rows
-        warehouse_rows = ""
-        for _, row in warehouses_df.iterrows():
-            util = row['Utilization_Percentage']
-            if util > UTILIZATION_THRESHOLD:
-                color = COLOR_OVERUTILIZED
-                status = "⚠️ Over-utilized"
-            else:
-                color = COLOR_UNDERUTILIZED
-                status = "✅ Under-utilized"
-            
-            warehouse_rows += f"""
+        # Status colour and label for every row from one vectorized comparison
+        over = warehouses_df['Utilization_Percentage'].to_numpy() > UTILIZATION_THRESHOLD
+        colors = np.where(over, COLOR_OVERUTILIZED, COLOR_UNDERUTILIZED)
+        statuses = np.where(over, "⚠️ Over-utilized", "✅ Under-utilized")
+        
+        row_parts = []
+        for row, color, status in zip(warehouses_df.itertuples(index=False), colors, statuses):
+            util = row.Utilization_Percentage
+            row_parts.append(f"""
             <tr>
-                <td style="padding: 12px; border: 1px solid #ddd;">{row['Warehouse_ID']}</td>
-                <td style="padding: 12px; border: 1px solid #ddd;">{row['Warehouse_Name']}</td>
-                <td style="padding: 12px; border: 1px solid #ddd; text-align: center;">{row['Total_Capacity_Pallets']}</td>
-                <td style="padding: 12px; border: 1px solid #ddd; text-align: center;">{row['Current_Pallets']}</td>
+                <td style="padding: 12px; border: 1px solid #ddd;">{row.Warehouse_ID}</td>
+                <td style="padding: 12px; border: 1px solid #ddd;">{row.Warehouse_Name}</td>
+                <td style="padding: 12px; border: 1px solid #ddd; text-align: center;">{row.Total_Capacity_Pallets}</td>
+                <td style="padding: 12px; border: 1px solid #ddd; text-align: center;">{row.Current_Pallets}</td>
                 <td style="padding: 12px; border: 1px solid #ddd; text-align: center; font-weight: bold; color: {color};">
                     {util}%
                 </td>
@@ -99,18 +230,18 @@ class EmailGenerator:
                     </span>
                 </td>
             </tr>
-            """
+            """)
+        warehouse_rows = "".join(row_parts)
         
         # Build recommendations section
-        recommendations_html = ""
         if recommendations:
-            recommendations_html = """
+            rec_parts = ["""
             <div style="background-color: #fff3cd; border-left: 4px solid #ffc107; padding: 20px; margin: 20px 0; border-radius: 5px;">
                 <h3 style="color: #856404; margin-top: 0;">📦 Recommended Pallet Movements</h3>
-            """
+            """]
             
             for rec in recommendations:
-                recommendations_html += f"""
+                rec_parts.append(f"""
                 <div style="background-color: white; padding: 15px; margin: 10px 0; border-radius: 5px; border: 1px solid #ffc107;">
                     <p style="margin: 5px 0; font-size: 16px;">
                         <strong>Move {rec['pallets_to_move']} pallets</strong> from 
@@ -122,16 +253,17 @@ class EmailGenerator:
                         This will reduce {rec['from_warehouse']}'s utilization from {rec['from_current_util']:.1f}% to below {UTILIZATION_THRESHOLD}%
                     </p>
                 </div>
-                """
+                """)
             
-            recommendations_html += f"""
+            rec_parts.append(f"""
                 <p style="margin-top: 15px; color: #856404;">
                     <strong>Impact:</strong> Following these recommendations will balance warehouse utilization 
                     across {region}, ensuring all facilities operate below the {UTILIZATION_THRESHOLD}% threshold 
                     for optimal efficiency and flexibility.
                 </p>
             </div>
-            """
+            """)
+            recommendations_html = "".join(rec_parts)
         else:
             recommendations_html = """
             <div style="background-color: #d4edda; border-left: 4px solid #28a745; padding: 20px; margin: 20px 0; border-radius: 5px;">
@@ -142,113 +274,45 @@ class EmailGenerator:
             </div>
             """
         
-        # Complete HTML template
-        html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <meta charset="UTF-8">
-            <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        </head>
-        <body style="font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif; line-height: 1.6; color: #333; margin: 0; padding: 0; background-color: #f4f4f4;">
-            <div style="max-width: 800px; margin: 20px auto; background-color: white; border-radius: 10px; overflow: hidden; box-shadow: 0 0 20px rgba(0,0,0,0.1);">
-                
-                <!-- Header -->
-                <div style="background: linear-gradient(135deg, #667eea 0%, #764ba2 100%); color: white; padding: 30px; text-align: center;">
-                    <h1 style="margin: 0; font-size: 28px;">🏭 Network Utilization Report</h1>
-                    <p style="margin: 10px 0 0 0; font-size: 16px; opacity: 0.9;">{COMPANY_NAME}</p>
-                </div>
-                
-                <!-- Content -->
-                <div style="padding: 30px;">
-                    <p style="font-size: 16px;">Dear {manager_name},</p>
-                    
-                    <p style="font-size: 15px; line-height: 1.8;">
-                        Our {AGENT_NAME} has completed its analysis of warehouse utilization across 
-                        <strong>{region}</strong> region as of <strong>{datetime.now().strftime('%B %d, %Y at %I:%M %p')}</strong>.
-                    </p>
-                    
-                    <div style="background-color: #e7f3ff; border-left: 4px solid #2196F3; padding: 15px; margin: 20px 0; border-radius: 5px;">
-                        <p style="margin: 0; color: #0c5c9c;">
-                            <strong>📊 Target Utilization:</strong> Below {UTILIZATION_THRESHOLD}% for optimal operations
-                        </p>
-                    </div>
-                    
-                    <h2 style="color: #667eea; border-bottom: 2px solid #667eea; padding-bottom: 10px;">
-                        Warehouse Status Overview - {region}
-                    </h2>
-                    
-                    <table style="width: 100%; border-collapse: collapse; margin: 20px 0; box-shadow: 0 2px 4px rgba(0,0,0,0.1);">
-                        <thead>
-                            <tr style="background-color: #667eea; color: white;">
-                                <th style="padding: 12px; text-align: left; border: 1px solid #ddd;">ID</th>
-                                <th style="padding: 12px; text-align: left; border: 1px solid #ddd;">Warehouse</th>
-                                <th style="padding: 12px; text-align: center; border: 1px solid #ddd;">Capacity</th>
-                                <th style="padding: 12px; text-align: center; border: 1px solid #ddd;">Current</th>
-                                <th style="padding: 12px; text-align: center; border: 1px solid #ddd;">Utilization</th>
-                                <th style="padding: 12px; text-align: center; border: 1px solid #ddd;">Status</th>
-                            </tr>
-                        </thead>
-                        <tbody style="background-color: white;">
-                            {warehouse_rows}
-                        </tbody>
-                    </table>
-                    
-                    {recommendations_html}
-                    
-                    <div style="background-color: #f8f9fa; padding: 20px; margin: 20px 0; border-radius: 5px; border: 1px solid #dee2e6;">
-                        <h3 style="color: #495057; margin-top: 0;">📌 Next Steps</h3>
-                        <ol style="color: #495057; line-height: 2;">
-                            <li>Review the recommendations above</li>
-                            <li>Coordinate with logistics teams for pallet movements</li>
-                            <li>Implement changes within the next 48-72 hours</li>
-                            <li>Monitor utilization levels post-implementation</li>
-                        </ol>
-                    </div>
-                    
-                    <p style="font-size: 15px;">
-                        If you have any questions or need assistance with implementation, please don't hesitate to reach out.
-                    </p>
-                    
-                    <p style="font-size: 15px;">
-                        Best regards,<br>
-                        <strong>{AGENT_NAME}</strong><br>
-                        <em>{COMPANY_NAME}</em>
-                    </p>
-                </div>
-                
-                <!-- Footer -->
-                <div style="background-color: #f8f9fa; padding: 20px; text-align: center; border-top: 1px solid #dee2e6;">
-                    <p style="margin: 0; font-size: 12px; color: #6c757d;">
-                        This is an automated report generated by AI. For support, contact your system administrator.
-                    </p>
-                    <p style="margin: 5px 0 0 0; font-size: 12px; color: #6c757d;">
-                        © {datetime.now().year} {COMPANY_NAME}. All rights reserved.
-                    </p>
-                </div>
-                
-            </div>
-        </body>
-        </html>
-        """
+        # Fill the precompiled email skeleton
+        html = _EMAIL_TEMPLATE.substitute(
+            region=region,
+            manager_name=manager_name,
+            report_time=now.strftime('%B %d, %Y at %I:%M %p'),
+            year=now.year,
+            warehouse_rows=warehouse_rows,
+            recommendations_html=recommendations_html
+        )
         
         return html
     
+    def _build_raw_message(self, recipient_email: str, subject: str, html_content: str) -> str:
+        """Build the base64url-encoded RFC 2822 message the Gmail API expects"""
+        # Single-part HTML message assembled directly, skipping the
+        # email.mime object tree. Addresses come from the workbook, so they
+        # are validated before being written into the headers
+        sender = _format_address(self.sender_email)
+        recipient = _format_address(recipient_email)
+        encoded_subject = Header(subject, 'utf-8').encode(linesep='\r\n')
+        headers = (
+            f"From: {sender}\r\n"
+            f"To: {recipient}\r\n"
+            f"Subject: {encoded_subject}\r\n"
+            "MIME-Version: 1.0\r\n"
+            "Content-Type: text/html; charset=\"utf-8\"\r\n"
+            "Content-Transfer-Encoding: base64\r\n"
+            "\r\n"
+        )
+        body = base64.encodebytes(html_content.encode('utf-8'))
+        
+        return base64.urlsafe_b64encode(headers.encode('ascii') + body).decode()
+    
     def send_email(self, recipient_email: str, subject: str, html_content: str) -> bool:
         """Send HTML email via Gmail API"""
+        from googleapiclient.errors import HttpError
+        
         try:
-            # Create message
-            message = MIMEMultipart("alternative")
-            message["Subject"] = subject
-            message["From"] = self.sender_email
-            message["To"] = recipient_email
-            
-            # Attach HTML content
-            html_part = MIMEText(html_content, "html")
-            message.attach(html_part)
-            
-            # Encode message
-            raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
+            raw_message = self._build_raw_message(recipient_email, subject, html_content)
             
             # Send message
             send_message = self.service.users().messages().send(
@@ -264,4 +328,61 @@ class EmailGenerator:
             return False
         except Exception as e:
             print(f"❌ Error sending email: {str(e)}")
-            return False
\ No newline at end of file
+            return False
+    
+    def send_emails_batch(self, messages: List[Tuple[str, str, str]]) -> List[Tuple[bool, str]]:
+        """
+        Send (recipient_email, subject, html_content) messages via Gmail batch requests
+        Returns one (success, error) pair per message, in input order
+        """
+        results = [(False, "Not sent")] * len(messages)
+        
+        def on_response(request_id, response, exception):
+            index = int(request_id)
+            if exception is not None:
+                print(f"❌ Gmail API error: {exception}")
+                results[index] = (False, str(exception))
+            else:
+                print(f"✅ Email sent successfully! Message ID: {response['id']}")
+                results[index] = (True, "")
+        
+        # One HTTP round trip per chunk instead of one per message. Chunks
+        # go out one after another so the per-user send rate stays within
+        # the limit GMAIL_BATCH_SIZE is sized for
+        for start in range(0, len(messages), GMAIL_BATCH_SIZE):
+            chunk = range(start, min(start + GMAIL_BATCH_SIZE, len(messages)))
+            
+            batch = self.service.new_batch_http_request(callback=on_response)
+            queued = []
+            for index in chunk:
+                recipient_email, subject, html_content = messages[index]
+                
+                # A message that can't be built only fails its own send
+                try:
+                    raw_message = self._build_raw_message(recipient_email, subject, html_content)
+                except Exception as e:
+                    print(f"❌ Error building email to {recipient_email!r}: {str(e)}")
+                    results[index] = (False, str(e))
+                    continue
+                
+                batch.add(
+                    self.service.users().messages().send(
+                        userId="me",
+                        body={"raw": raw_message}
+                    ),
+                    request_id=str(index)
+                )
+                queued.append(index)
+            
+            if not queued:
+                continue
+            
+            try:
+                batch.execute()
+            except Exception as e:
+                print(f"❌ Error sending email batch: {str(e)}")
+                for index in queued:
+                    if not results[index][0]:
+                        results[index] = (False, str(e))
+        
+        return results